@@ -1,114 +1,112 @@
-import os
-import time
-import tempfile
 import traceback
-import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 from datetime import datetime
 
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-
-import requests
 from bs4 import BeautifulSoup
 
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-
-# === 1. スプレッドシート設定 ===
-SPREADSHEET_ID = '1LpduIjFPimgUX6g1j5cfLnMT6OayfA5un3it2Z5rwuE'
-SHEET_NAME = '新着物件'
-
-# === 2. 認証ファイル生成 ===
-def create_credentials_file():
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".json") as tmp:
-        tmp.write(os.environ['GOOGLE_CREDENTIALS_JSON'].encode())
-        return tmp.name
-
-# === 3. SUUMO 各エリアの新着物件一覧から物件名を取得 ===
-def fetch_suumo_properties():
-    base_url = "https://suumo.jp"
-    area_paths = [
-        "/ms/shinchiku/hokkaido/",
-        "/ms/shinchiku/tohoku/",
-        "/ms/shinchiku/kanto/",
-        "/ms/shinchiku/chubu/",
-        "/ms/shinchiku/kinki/",
-        "/ms/shinchiku/chugoku/",
-        "/ms/shinchiku/shikoku/",
-        "/ms/shinchiku/kyushu/"
-    ]
-
-    headers = {"User-Agent": "Mozilla/5.0"}
-    all_props = []
-
-    for path in area_paths:
-        url = base_url + path
-        res = requests.get(url, headers=headers)
-        if res.status_code != 200:
-            print(f"❌ エリアページ取得失敗: {url}")
-            continue
-
-        soup = BeautifulSoup(res.text, 'html.parser')
-        new_link_tag = soup.find("div", class_="feed-title", string=lambda text: text and "今週の" in text)
-        if new_link_tag:
-            parent = new_link_tag.find_parent("div", class_="feed")
-            if parent:
-                link_tag = parent.select_one(".feed-box-link a")
-                if link_tag and link_tag.get("href"):
-                    list_url = base_url + link_tag["href"]
-                else:
-                    print(f"⚠️ 新着物件リンクが見つかりません: {url}")
-                    continue
+# シート設定・共有セッション・レート制御・認証は2スクリプト共通の土台から
+from scrape_core import SESSION, TokenBucket, create_credentials_file, get_sheet
+
+# suumo.jp 向け: 平均4req/s・バースト4まで
+_SUUMO_BUCKET = TokenBucket(rate=4, capacity=4)
+
+# === 1. SUUMO 各エリアの新着物件一覧から物件名を取得 ===
+BASE_URL = "https://suumo.jp"
+AREA_PATHS = [
+    "/ms/shinchiku/hokkaido/",
+    "/ms/shinchiku/tohoku/",
+    "/ms/shinchiku/kanto/",
+    "/ms/shinchiku/chubu/",
+    "/ms/shinchiku/kinki/",
+    "/ms/shinchiku/chugoku/",
+    "/ms/shinchiku/shikoku/",
+    "/ms/shinchiku/kyushu/"
+]
+
+def _fetch_area(path):
+    """1エリア分の新着物件名リストを取得する。失敗時は空リスト。"""
+    url = BASE_URL + path
+    # 1エリアの失敗（タイムアウト等）で全体を落とさない
+    try:
+        _SUUMO_BUCKET.acquire()
+        res = SESSION.get(url, timeout=10)
+    except Exception as e:
+        print(f"❌ エリアページ取得失敗: {url} - {e}")
+        return []
+    if res.status_code != 200:
+        print(f"❌ エリアページ取得失敗: {url}")
+        return []
+
+    soup = BeautifulSoup(res.text, 'lxml')
+    new_link_tag = soup.find("div", class_="feed-title", string=lambda text: text and "今週の" in text)
+    if new_link_tag:
+        parent = new_link_tag.find_parent("div", class_="feed")
+        if parent:
+            link_tag = parent.select_one(".feed-box-link a")
+            if link_tag and link_tag.get("href"):
+                list_url = BASE_URL + link_tag["href"]
             else:
-                print(f"⚠️ feed-box が見つかりません: {url}")
-                continue
+                print(f"⚠️ 新着物件リンクが見つかりません: {url}")
+                return []
         else:
-            print(f"⚠️ 新着物件タイトルが見つかりません: {url}")
-            continue
+            print(f"⚠️ feed-box が見つかりません: {url}")
+            return []
+    else:
+        print(f"⚠️ 新着物件タイトルが見つかりません: {url}")
+        return []
 
-        print(f"🔍 取得中: {list_url}")
-        res_list = requests.get(list_url, headers=headers)
-        if res_list.status_code != 200:
-            print(f"❌ 一覧ページ取得失敗: {list_url}")
-            continue
+    print(f"🔍 取得中: {list_url}")
+    try:
+        _SUUMO_BUCKET.acquire()
+        res_list = SESSION.get(list_url, timeout=10)
+    except Exception as e:
+        print(f"❌ 一覧ページ取得失敗: {list_url} - {e}")
+        return []
+    if res_list.status_code != 200:
+        print(f"❌ 一覧ページ取得失敗: {list_url}")
+        return []
+
+    list_soup = BeautifulSoup(res_list.text, 'lxml')
+    return [a.text.strip() for a in list_soup.select("a.cassette_header-title") if a.text.strip()]
 
-        list_soup = BeautifulSoup(res_list.text, 'html.parser')
-        for a in list_soup.select("a.cassette_header-title"):
-            name = a.text.strip()
-            if name:
-                all_props.append(name)
-        time.sleep(1)
+def fetch_suumo_properties():
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        results = ex.map(_fetch_area, AREA_PATHS)
+
+    # 挿入順を保つdictでフラット化しながら重複除去（中間リスト不要）
+    seen = {}
+    for names in results:
+        for name in names:
+            seen.setdefault(name, None)
 
-    unique = list(dict.fromkeys(all_props))
+    unique = list(seen)
     print(f"✅ 取得済み物件（重複除去）: {len(unique)} 件")
     return unique
 
-# === 4. スプレッドシートへ記録（B:物件名, C:マンションコミュニティURL） ===
+# === 2. スプレッドシートへ記録（B:物件名, C:マンションコミュニティURL） ===
 def write_to_sheet(names, cred_path):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(cred_path, scope)
-    client = gspread.authorize(creds)
-    sheet = client.open_by_key(SPREADSHEET_ID).worksheet(SHEET_NAME)
+    sheet = get_sheet(cred_path)
 
-    existing_names = sheet.col_values(2)[1:]
+    existing_names = set(sheet.col_values(2)[1:])
     today = datetime.now().strftime('%Y/%m/%d')
-    new_count = 0
+    new_rows = []
 
     for name in names:
         if name in existing_names:
             print(f"⏭️ スキップ（重複）: {name}")
             continue
 
-        mc_url = f"https://www.e-mansion.co.jp/bbs/search/?q={name}"
-        sheet.append_row([today, name, mc_url])
-        new_count += 1
-        time.sleep(1)
+        # 物件名は日本語・記号を含むためクエリとしてエンコードする
+        mc_url = f"https://www.e-mansion.co.jp/bbs/search/?q={quote(name)}"
+        new_rows.append([today, name, mc_url])
+
+    if new_rows:
+        sheet.append_rows(new_rows, value_input_option='RAW')
 
-    print(f"✅ 新規追加: {new_count} 件")
+    print(f"✅ 新規追加: {len(new_rows)} 件")
 
-# === 5. メイン処理 ===
+# === 3. メイン処理 ===
 def main():
     try:
         cred = create_credentials_file()
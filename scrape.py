@@ -1,80 +1,118 @@
 # scrape.py
+import atexit
+import codecs
+import json
 import os
+import random
+import shelve
 import time
-import tempfile
+import threading
 import traceback
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from html import unescape
+from urllib.parse import quote, urljoin, urlparse
 
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
 
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+# シート設定・共有セッション・レート制御・認証は2スクリプト共通の土台から
+from scrape_core import SESSION, TokenBucket, create_credentials_file, get_sheet
 
 
-# === 1. スプレッドシート設定 ===
-SPREADSHEET_ID = '1LpduIjFPimgUX6g1j5cfLnMT6OayfA5un3it2Z5rwuE'
-SHEET_NAME = '新着物件'
-
-# === 2. Google API設定 ===
+# === 1. Google API設定 ===
 GOOGLE_API_KEY = os.environ['GOOGLE_API_KEY']
 GOOGLE_CSE_ID = os.environ['GOOGLE_CSE_ID']
 
-# === 3. 認証ファイル生成 ===
-def create_credentials_file():
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".json") as tmp:
-        tmp.write(os.environ['GOOGLE_CREDENTIALS_JSON'].encode())
-        return tmp.name
+# Google CSE 向け: 平均2req/s・バースト5まで（クォータに対して十分保守的）
+_CSE_BUCKET = TokenBucket(rate=2, capacity=5)
 
 
 # ==============================
 # 追加：詳細抽出ヘルパー（<td>を丸ごと→不要除去→整形）
 # ==============================
 
+# 正規化ヘルパーで使う正規表現はモジュールロード時に一度だけコンパイル
+_RE_WS = re.compile(r"\s{2,}")
+_RE_DIGITS = re.compile(r"(\d+)")
+_RE_LAYOUT = re.compile(r"([0-9０-９]+)\s*(LDK|DK|K|R)", re.I)
+# 単位ゆれ（㎡/m²/m^2/m２/m 2/末尾m）を1回のsubで中間表現 m2 に寄せる
+_RE_AREA_UNIT = re.compile(r"㎡|m²|m\^2|m\s*２|m\s*2\b|\bm\s*$")
+# 先頭記号・注釈語・括弧書きの除去も1回のsubにまとめる
+_RE_AREA_STRIP = re.compile(r"^[：:/\-\s]+|\s*(?:超|平均|前後|程度)|[（(].*?[)）]")
+# 数値単体とレンジ（44.83m2～74.57m2）を同じ1パスで拾う
+_RE_AREA_ALL = re.compile(r"(\d+(?:\.\d+)?)\s*m2(?:\s*[～~]\s*(\d+(?:\.\d+)?)\s*m2)?")
+
+# 全角→半角の変換テーブル（呼び出しごとのmaketrans再構築を排除）
+_ZEN2HAN_DIGITS = str.maketrans("０１２３４５６７８９", "0123456789")
+_ZEN2HAN_AREA = str.maketrans("０１２３４５６７８９．，－", "0123456789.,-")
+_ZEN2HAN_UNITS = str.maketrans("０１２３４５６７８９，", "0123456789,")
+
+# タブ/改行/NBSP→スペース、ゼロ幅スペース→削除 を1回のtranslateで行う
+_SANITIZE_TRANS = str.maketrans({"\t": " ", "\r": " ", "\n": " ", "\u00A0": " ", "\u200B": None})
+
 def _sanitize_cell(x: str) -> str:
     """セル内のタブ/改行/連続空白を除去して安定化。"""
     if x is None:
         return ""
-    s = re.sub(r"[\t\r\n]+", " ", str(x))
-    s = s.replace("\u00A0", " ").replace("\u200B", "")  # NBSP / ゼロ幅
-    s = re.sub(r"\s{2,}", " ", s).strip()
-    return s
+    return _RE_WS.sub(" ", str(x).translate(_SANITIZE_TRANS)).strip()
 
 def _clean_td_text(td):
     """<td> 内の不要要素（リンク等）を削除してテキスト化。"""
     for e in td.select('span.link-s, .link-s, a'):
         e.decompose()
-    text = td.get_text(" ", strip=True)
-    text = text.replace("\u00A0", " ").replace("\u200B", "")
-    text = re.sub(r"\s{2,}", " ", text)
-    return text
-
-def _get_td_by_label(soup, th_label_regex: str) -> str:
-    """与えたラベル(th)に対応する次の<td>をテキストで返す。見つからなければ空。"""
-    th = soup.find('th', string=re.compile(rf"^\s*{th_label_regex}\s*$"))
-    if not th:
-        return ""
-    td = th.find_next_sibling('td')
-    if not td:
-        return ""
-    return _clean_td_text(td)
+    text = td.get_text(" ", strip=True).translate(_SANITIZE_TRANS)
+    return _RE_WS.sub(" ", text)
+
+# 抽出対象ラベル → フィールド名（総戸数のみ表現ゆれがあるため部分一致で別扱い）
+_LABEL_FIELDS = {
+    "住所": "address", "所在地": "address",
+    "交通": "access",
+    "間取り": "layout", "間取": "layout",
+    "専有面積": "area",
+}
+
+def _extract_label_tds(soup):
+    """表の行を1回だけ走査し、対象フィールドに対応するtdをまとめて取り出す。"""
+    found = {}
+    for tr in soup.find_all("tr"):
+        th = tr.find("th")
+        if th is None:
+            continue
+        label = th.get_text(strip=True)
+        key = _LABEL_FIELDS.get(label)
+        if key is None and "総戸数" in label:
+            key = "total_units"
+        if key is None or key in found:
+            continue
+        td = tr.find("td")
+        if td is not None:
+            found[key] = td
+    return found
 
 def _normalize_layout_from_td(raw: str) -> str:
     """
     間取りを '2LDK・3LDK' のように統一（順序維持＆重複除去）。
     1K/1DK/1LDK/1R/… を抽出し、半角化して '・' 連結。
     """
-    txt = (raw or "").replace("　", " ")
-    hits = re.findall(r"([0-9０-９]+)\s*(LDK|DK|K|R)", txt, flags=re.I)
+    if not raw:
+        return ""
+    # 間取り表記に必須の文字が無ければ正規表現に入らず即終了
+    if not any(c in raw for c in "KDLRkdlr") and "ワンルーム" not in raw:
+        return ""
+    # 先に全角数字を半角へ寄せてから抽出（マッチごとの変換を排除）
+    txt = raw.replace("　", " ").translate(_ZEN2HAN_DIGITS)
+    hits = _RE_LAYOUT.findall(txt)
     out, seen = [], set()
     for num, typ in hits:
-        num = num.translate(str.maketrans("０１２３４５６７８９", "0123456789"))
         typ = typ.upper()
         key = f"{num}{typ}"
         if key not in seen:
@@ -98,35 +136,30 @@ def _normalize_area_from_td(raw: str) -> str:
     専有面積を '44.83㎡～74.57㎡' 形式に統一。
     ㎡/m²/m^2/m２/m 2/m を中間表現 m2 に寄せてから抽出し、最終は必ず「㎡」で出力。
     """
+    # 面積らしき文字が無いセルは正規表現群を通さず即終了
+    if not raw or ("m" not in raw and "㎡" not in raw and "ｍ" not in raw):
+        return ""
+
     def cleanup_to_m2(s: str) -> str:
         s = s or ""
         s = s.replace("\u00A0", " ").replace("\u200B", "")
-        # 単位ゆれ → m2 へ寄せる
-        s = s.replace("㎡", "m2")
-        s = s.replace("m²", "m2")
-        s = s.replace("m^2", "m2")
-        s = re.sub(r"m\s*２", "m2", s)     # m２ → m2
-        s = re.sub(r"m\s*2\b", "m2", s)    # m 2 / m\t2 / m\n2
-        s = re.sub(r"\bm\s*$", "m2", s)    # 末尾 m → m2
+        # 単位ゆれ → m2 へ寄せる（1回のsub）
+        s = _RE_AREA_UNIT.sub("m2", s)
         # 全角数字→半角、区切り除去
-        s = s.translate(str.maketrans("０１２３４５６７８９．，－", "0123456789.,-")).replace(",", "")
-        # 余計な先頭記号・注釈・説明語
-        s = re.sub(r"^[：:/\-\s]+", "", s)
-        s = re.sub(r"\s*(超|平均|前後|程度)", "", s)
-        s = re.sub(r"[（(].*?[)）]", "", s)
+        s = s.translate(_ZEN2HAN_AREA).replace(",", "")
+        # 余計な先頭記号・注釈・説明語・括弧書き（1回のsub）
+        s = _RE_AREA_STRIP.sub("", s)
         return s.strip()
 
     txt = cleanup_to_m2(raw)
-    wave = r"(?:～|~)"
-
-    # 明示レンジ
-    m = re.search(rf"(\d+(?:\.\d+)?)\s*m2\s*{wave}\s*(\d+(?:\.\d+)?)\s*m2", txt)
-    if m:
-        a, b = float(m.group(1)), float(m.group(2))
-        return f"{_normalize_area_to_tsubo_m2_display(a)}～{_normalize_area_to_tsubo_m2_display(b)}"
 
-    # m2の出現を全部拾って最小～最大
-    nums = [float(x) for x in re.findall(r"(\d+(?:\.\d+)?)\s*m2", txt)]
+    # 数値とレンジを1パスで抽出（明示レンジが見つかったら即確定）
+    nums = []
+    for m in _RE_AREA_ALL.finditer(txt):
+        if m.group(2):
+            a, b = float(m.group(1)), float(m.group(2))
+            return f"{_normalize_area_to_tsubo_m2_display(a)}～{_normalize_area_to_tsubo_m2_display(b)}"
+        nums.append(float(m.group(1)))
     if len(nums) >= 2:
         nums.sort()
         return f"{_normalize_area_to_tsubo_m2_display(nums[0])}～{_normalize_area_to_tsubo_m2_display(nums[-1])}"
@@ -147,49 +180,53 @@ def _normalize_total_units(raw: str) -> str:
         return ""
     s = raw.replace("\u00A0", " ").replace("\u200B", "")
     # 全角数字→半角 / カンマ除去
-    s = s.translate(str.maketrans("０１２３４５６７８９，", "0123456789,"))
+    s = s.translate(_ZEN2HAN_UNITS)
     s = s.replace(",", "")
-    m = re.search(r"(\d+)", s)
+    m = _RE_DIGITS.search(s)
     return m.group(1) if m else ""
 
 
-def fetch_property_details(url, driver):
+# 詳細ページで実際に読むタグだけツリー化する（title・画像リンク・img・表）
+_DETAIL_TAGS = SoupStrainer(["title", "a", "img", "table"])
+
+# 画像URL抽出用（ページごとの再コンパイルを排除）
+_RE_GOO_IMG = re.compile(r"^https://img\.house\.goo\.ne\.jp/")
+_RE_IMG_500 = re.compile(r"\?500\b")
+
+def fetch_property_details(soup):
     """
+    パース済み詳細ページから
     画像URL / 住所 / 交通 / 間取り（2LDK・3LDK） / 専有面積（xx.xx㎡～yy.yy㎡） / 総戸数
     を抽出して返す。
     """
-    driver.get(url)
-    time.sleep(1.2)  # JS描画の安定待ち
-
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-
     # 画像URL：a.image-popup 最優先 → img[src^=https://img.house.goo.ne.jp] を ?700 に寄せる
     image_url = ""
     a_img = soup.select_one('a.image-popup[href^="https://img.house.goo.ne.jp/"]')
     if a_img and a_img.has_attr("href"):
         image_url = a_img["href"]
     else:
-        img = soup.find("img", src=re.compile(r"^https://img\.house\.goo\.ne\.jp/"))
+        img = soup.find("img", src=_RE_GOO_IMG)
         if img and img.has_attr("src"):
-            image_url = re.sub(r"\?500\b", "?700", img["src"])
+            image_url = _RE_IMG_500.sub("?700", img["src"])
+
+    # ラベル直の <td> を“丸ごと”取得してから整形（走査は全フィールドで1回だけ）
+    label_tds = _extract_label_tds(soup)
 
-    # ラベル直の <td> を“丸ごと”取得してから整形
-    address_raw = _get_td_by_label(soup, r"(住所|所在地)")
-    access_raw  = _get_td_by_label(soup, r"交通")
-    layout_raw  = _get_td_by_label(soup, r"(間取り|間取)")
-    area_raw    = _get_td_by_label(soup, r"専有面積")
+    def _td_text(key):
+        td = label_tds.get(key)
+        return _clean_td_text(td) if td is not None else ""
+
+    address_raw = _td_text("address")
+    access_raw  = _td_text("access")
+    layout_raw  = _td_text("layout")
+    area_raw    = _td_text("area")
 
     layout = _normalize_layout_from_td(layout_raw)
     area   = _normalize_area_from_td(area_raw)
 
-    # 総戸数（ラベル表現ゆれ対応）: 「総戸数」を含む th を探す
-    total_units_raw = ""
-    for tr in soup.select("table tr"):
-        th = tr.find("th")
-        td = tr.find("td")
-        if th and td and re.search(r"総戸数", th.get_text()):
-            total_units_raw = td.get_text(" ", strip=True)
-            break
+    # 総戸数（ラベル表現ゆれ対応）も同じ走査で拾い済み
+    td_units = label_tds.get("total_units")
+    total_units_raw = td_units.get_text(" ", strip=True) if td_units is not None else ""
     total_units = _normalize_total_units(total_units_raw)
 
     return {
@@ -207,18 +244,80 @@ def fetch_property_details(url, driver):
 # gooトップ → 物件リンク → タイトル整形
 # ==============================
 
+# title正規化用。先頭の媒体名と「（価格・間取り）付き/なし」の定型尾部は
+# 1本のオルタネーションで1パス除去できる
+_RE_TITLE_STRIP = re.compile(
+    r"^【goo住宅・不動産】"
+    r"|(?:（価格・間取り）)?\s*物件情報｜新築マンション・分譲マンション.*$"
+)
+# 末尾の括弧・空白は尾部除去後に現れるため2パス目で落とす（順序依存）
+_RE_TITLE_TAIL = re.compile(r"[（）\s]+$")
+
 def _normalize_name_from_title(title: str) -> str:
     """
     gooのtitleから余計な尾部を除去。
     """
     t = (title or "").strip()
-    t = re.sub(r"^【goo住宅・不動産】", "", t)
-    t = re.sub(r"（価格・間取り）\s*物件情報｜新築マンション・分譲マンション.*$", "", t)
-    t = re.sub(r"\s*物件情報｜新築マンション・分譲マンション.*$", "", t)
-    t = re.sub(r"[（）\s]+$", "", t)
+    t = _RE_TITLE_STRIP.sub("", t)
+    t = _RE_TITLE_TAIL.sub("", t)
     return t.strip()
 
-def fetch_property_infos():
+LISTING_URL = "https://house.goo.ne.jp/buy/bm/"
+
+# 詳細URLに含まれる物件ID（クエリ違いの同一物件URLをまとめるキー）
+_RE_GOO_ID = re.compile(r"/buy/bm/detail/(\d+)")
+
+# 生HTMLから<title>だけ先に抜くための正規表現（スキップ判定にsoupを作らない）。
+# バイト列のまま探すことで、スキップ対象はボディ全体のデコードすら行わない。
+_RE_TITLE_TAG_B = re.compile(rb"<title[^>]*>(.*?)</title>", re.S | re.I)
+_RE_META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w.-]+)""", re.I)
+
+def _detect_encoding(res, head: bytes) -> str:
+    """文字コードを meta charset → ヘッダ明示 → UTF-8 の順で決める。
+
+    charset無しのtext/htmlでrequestsが既定にするISO-8859-1を信用すると
+    日本語titleが文字化けする（stream経路ではapparent_encodingも働かない）。
+    """
+    m = _RE_META_CHARSET.search(head)
+    if m:
+        enc = m.group(1).decode("ascii", "replace")
+        try:
+            codecs.lookup(enc)
+            return enc
+        except LookupError:
+            pass
+    if "charset=" in res.headers.get("Content-Type", "").lower():
+        return res.encoding or "utf-8"
+    return "utf-8"
+
+def _fetch_listing_urls_static():
+    """一覧ページがサーバーレンダリングならSeleniumなしで物件リンクを列挙。"""
+    try:
+        res = SESSION.get(LISTING_URL, timeout=10)
+        res.raise_for_status()
+    except Exception as e:
+        print("⚠️ 一覧ページの静的取得失敗:", e)
+        return []
+    soup = BeautifulSoup(res.text, "lxml")
+    # 静的HTMLのhrefは相対パスのことがあるため絶対URLに揃える
+    return [urljoin(LISTING_URL, a["href"]) for a in soup.select("ul.bxslider li a[href]")]
+
+# Chrome起動は数秒かかる固定コストなので、プロセス内で1個だけ遅延生成して
+# 使い回す（スケジューラ等からmainを複数回呼ばれても起動し直さない）
+_DRIVER = None
+
+def _quit_driver():
+    global _DRIVER
+    if _DRIVER is not None:
+        _DRIVER.quit()
+        _DRIVER = None
+
+atexit.register(_quit_driver)
+
+def _get_driver():
+    global _DRIVER
+    if _DRIVER is not None:
+        return _DRIVER
     options = Options()
     options.binary_location = "/usr/bin/google-chrome"
     options.add_argument('--headless=new')
@@ -226,59 +325,190 @@ def fetch_property_infos():
     options.add_argument('--disable-dev-shm-usage')
     options.add_argument('--window-size=1920,1080')
     options.add_argument('--user-agent=Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36')
+    # レンダラ側でも画像デコードを止め、拡張機能の起動コストを省く
+    options.add_argument('--blink-settings=imagesEnabled=false')
+    options.add_argument('--disable-extensions')
+    # 画像・CSS・フォントはスクレイプに不要なのでダウンロード自体を止める
+    options.add_experimental_option('prefs', {
+        'profile.managed_default_content_settings.images': 2,
+        'profile.managed_default_content_settings.stylesheets': 2,
+        'profile.managed_default_content_settings.fonts': 2,
+    })
+    # DOMContentLoadedで制御を返す（全リソースのロード完了を待たない）
+    options.page_load_strategy = 'eager'
 
     service = Service("/usr/bin/chromedriver")
     driver = webdriver.Chrome(service=service, options=options)
-    driver.get("https://house.goo.ne.jp/buy/bm/")
-    time.sleep(5)
 
-    elems = driver.find_elements(By.CSS_SELECTOR, "ul.bxslider li a")
-    urls = [a.get_attribute("href") for a in elems if a.get_attribute("href")]
+    # CDPレベルで画像/フォント/CSS/計測タグをブロックしてページロードを軽量化
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': [
+        '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg',
+        '*.woff', '*.woff2', '*.css', '*/analytics*',
+    ]})
 
-    properties = []
-    seen_names = set()
+    _DRIVER = driver
+    return driver
 
-    for url in urls:
-        try:
-            driver.get(url)
-            time.sleep(1)
-            title = driver.title or ""
+def _fetch_listing_urls_selenium():
+    """JSレンダリングが必要だった場合のフォールバック。一覧ページだけSeleniumで開く。"""
+    try:
+        driver = _get_driver()
+        driver.get(LISTING_URL)
+        # 固定スリープではなく、読みたい要素が現れた時点で先へ進む
+        WebDriverWait(driver, 15).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, "ul.bxslider li a"))
+        )
+        # href収集は1回のJS実行でまとめる（要素ごとのWebDriver往復を排除）
+        return driver.execute_script(
+            "return Array.from(document.querySelectorAll('ul.bxslider li a'))"
+            ".map(a => a.href).filter(Boolean);"
+        )
+    except Exception:
+        # 壊れたブラウザを使い回さない（次回呼び出しで再起動する）
+        _quit_driver()
+        raise
+
+def _fetch_property(url, existing=frozenset()):
+    """詳細ページ1件を取得して (name, 詳細dict) を返す。
+
+    シート掲載済みは (name, None)（スキップだが取得自体は成功）、
+    対象外・失敗時は None。
+    """
+    try:
+        # ストリーミングで先頭チャンクから<title>だけ先に読み、
+        # スキップ対象なら残りのボディをダウンロードせずに接続を閉じる
+        with SESSION.get(url, timeout=10, stream=True) as res:
+            res.raise_for_status()
+            chunks = res.iter_content(8192)
+            buf = bytearray()
+            m = None
+            for chunk in chunks:
+                buf += chunk
+                m = _RE_TITLE_TAG_B.search(buf)
+                if m:
+                    break
+            encoding = _detect_encoding(res, bytes(buf))
+            # driver.titleが暗黙にやっていた実体参照の解決（&amp;等）も行う
+            title = unescape(m.group(1).decode(encoding, "replace")) if m else ""
             name = _normalize_name_from_title(title)
-            if not name or "goo住宅・不動産" in name or name in seen_names:
+            if not name or "goo住宅・不動産" in name:
+                return None
+            if name in existing:
+                # シート掲載済み → 残りのDL・DOM構築・詳細抽出・CSE照会すべて不要
+                print(f"⏭️ スキップ（既存）: {name}")
+                return name, None
+            # 掲載対象と分かってから残りを読み切る
+            for chunk in chunks:
+                buf += chunk
+            html = bytes(buf).decode(encoding, "replace")
+        soup = BeautifulSoup(html, "lxml", parse_only=_DETAIL_TAGS)
+        detail = fetch_property_details(soup)
+        return name, {
+            'name': name,
+            'detail_url': url,
+            **detail
+        }
+    except Exception as e:
+        print("❌ タイトル/詳細取得失敗:", url, "-", e)
+        return None
+
+def fetch_property_infos(existing_names=None):
+    existing = frozenset(existing_names or ())
+
+    # 静的HTMLで取れればSeleniumを一切起動しない
+    urls = _fetch_listing_urls_static()
+    if not urls:
+        urls = _fetch_listing_urls_selenium()
+
+    # 一覧が1件も取れない＝スクレイプ自体の失敗。
+    # 「全件が既存でスキップされた」正常日とはここで区別する
+    if not urls:
+        print("❌ 物件が取得できませんでした。")
+        return
+
+    # 同じ物件が複数スライドやクエリ違いURLで載ることがあるため、
+    # 取得前に物件ID単位（IDが無いURLはURL全体）で重複除去
+    seen_keys = set()
+    deduped = []
+    for u in urls:
+        m = _RE_GOO_ID.search(u)
+        key = m.group(1) if m else u
+        if key not in seen_keys:
+            seen_keys.add(key)
+            deduped.append(u)
+    urls = deduped
+
+    # 詳細ページは同一ホストなのでプール済みセッションで並列取得。
+    # 完成した物件から順にyieldし、後段（CSE照会・シート書き込み準備）と
+    # フェッチをオーバーラップさせる。
+    count = 0
+    new_count = 0
+    seen_names = set()
+    with ThreadPoolExecutor(max_workers=12) as ex:
+        for result in ex.map(lambda u: _fetch_property(u, existing), urls):
+            if not result:
+                continue
+            name, p = result
+            if name in seen_names:
                 continue
-            detail = fetch_property_details(url, driver)
-            properties.append({
-                'name': name,
-                'detail_url': url,
-                **detail
-            })
             seen_names.add(name)
-        except Exception as e:
-            print("❌ タイトル/詳細取得失敗:", e)
-
-    driver.quit()
-    print(f"✅ 取得済み物件: {len(properties)} 件")
-    for p in properties:
-        print("・", p['name'])
-    return properties
-
-
-# === 6. Google検索で公式URLを取得（リトライ付き）===
+            count += 1
+            if p is None:
+                continue  # 既存スキップ（取得成功として件数にだけ算入）
+            new_count += 1
+            print("・", name)
+            yield p
+
+    print(f"✅ 取得済み物件: {count} 件（新規 {new_count} 件）")
+
+
+# === 2. Google検索で公式URLを取得（リトライ付き・同一クエリはメモ化）===
+# 公式URLは短期間では変わらないため、実行をまたいでディスクにキャッシュする。
+# 同名物件が翌日以降の実行に再登場してもCSEクォータを消費しない。
+_CSE_CACHE_PATH = "official_url_cache.db"
+_CSE_CACHE_TTL = 7 * 24 * 3600  # 7日
+_CSE_CACHE = shelve.open(_CSE_CACHE_PATH)
+_CSE_CACHE_LOCK = threading.Lock()
+atexit.register(_CSE_CACHE.close)
+
+@lru_cache(maxsize=None)
 def get_official_url(query):
-    search_url = f"https://www.googleapis.com/customsearch/v1?q={query}&key={GOOGLE_API_KEY}&cx={GOOGLE_CSE_ID}&num=1"
+    """公式URLを返す。ディスクキャッシュ（7日TTL）→ CSE の順で解決する。"""
+    with _CSE_CACHE_LOCK:
+        hit = _CSE_CACHE.get(query)
+        if hit is not None:
+            url, stamp = hit
+            if time.time() - stamp < _CSE_CACHE_TTL:
+                return url
+    url = _fetch_official_url(query)
+    if url:
+        with _CSE_CACHE_LOCK:
+            _CSE_CACHE[query] = (url, time.time())
+    return url
+
+def _fetch_official_url(query):
+    params = {"q": query, "key": GOOGLE_API_KEY, "cx": GOOGLE_CSE_ID, "num": 1}
     for attempt in range(3):
         try:
-            res = requests.get(search_url)
+            _CSE_BUCKET.acquire()
+            res = SESSION.get("https://www.googleapis.com/customsearch/v1", params=params, timeout=10)
             if res.status_code == 429:
-                wait = 10
-                print(f"⚠️ API制限（429）: {wait}秒待機して再試行... ({attempt + 1}/3)")
+                # サーバー指定のRetry-Afterを優先。無ければ指数バックオフ
+                # （5s→10s→20s, 上限30s）にジッタを乗せて再衝突を避ける
+                retry_after = res.headers.get("Retry-After")
+                wait = float(retry_after) if retry_after else min(30.0, 5.0 * (2 ** attempt))
+                wait += random.uniform(0, 0.3 * wait)
+                print(f"⚠️ API制限（429）: {wait:.1f}秒待機して再試行... ({attempt + 1}/3)")
                 time.sleep(wait)
                 continue
             res.raise_for_status()
             items = res.json().get('items', [])
             for item in items:
                 link = item.get('link', '')
-                if any(domain in link for domain in ['.co.jp', '.jp']) and 'suumo' not in link:
+                # パスに'.jp'や'suumo'が紛れても誤判定しないよう、ホスト名で判定する
+                host = urlparse(link).hostname or ''
+                if host.endswith('.jp') and 'suumo' not in host:
                     return link
             return items[0]['link'] if items else ''
         except Exception as e:
@@ -287,71 +517,113 @@ def get_official_url(query):
     return ''
 
 
-# === 7. スプレッドシートへ記載（A列から固定11列, RAW, 改行/タブ除去）===
-def _next_empty_row_in_col_a(sheet):
-    """A列の次の空行番号（1始まり）を返す。A列が常に埋まる前提でシンプル・高速。"""
-    col_a = sheet.col_values(1)  # A列
-    return len(col_a) + 1  # 次の空行
+# === 3. スプレッドシートへ記載（A列から固定11列, RAW, 改行/タブ除去）===
+# 既存物件名のローカルキャッシュ。シートの最終更新時刻が前回と同じなら
+# B列全体のダウンロードを省略できる
+_NAMES_CACHE_PATH = "existing_names_cache.json"
+
+def _load_existing_names(cred_path):
+    """B列の既存物件名を読み、スクレイプ前のスキップ判定に使う。
+
+    シートが前回実行から更新されていなければローカルキャッシュで済ませる
+    （メタデータ1件の取得 vs 全行ダウンロード）。
+    """
+    sheet = get_sheet(cred_path)
+    try:
+        # プロパティ版lastUpdateTimeはメモ化されて古い値を返しうるため
+        # 毎回取得するメソッド版を使う
+        stamp = sheet.spreadsheet.get_lastUpdateTime()
+    except Exception:
+        stamp = None
+
+    if stamp:
+        try:
+            with open(_NAMES_CACHE_PATH, encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("lastUpdateTime") == stamp:
+                return set(cached.get("names", []))
+        except (OSError, ValueError):
+            pass
+
+    names = set(sheet.col_values(2)[1:])
+    if stamp:
+        try:
+            with open(_NAMES_CACHE_PATH, "w", encoding="utf-8") as f:
+                json.dump({"lastUpdateTime": stamp, "names": sorted(names)},
+                          f, ensure_ascii=False)
+        except OSError:
+            pass
+    return names
 
 def write_to_sheet(properties, cred_path):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(cred_path, scope)
-    client = gspread.authorize(creds)
-    sheet = client.open_by_key(SPREADSHEET_ID).worksheet(SHEET_NAME)
+    sheet = get_sheet(cred_path)
 
-    existing = sheet.col_values(2)[1:]  # B列: 物件名（ヘッダ除く）
+    # A列（次の空行の計算用）とB列（既存物件名）を1回のAPI呼び出しでまとめて取得
+    col_a, col_b = sheet.batch_get(["A1:A", "B2:B"])
+    existing = {row[0] for row in col_b if row}  # B列: 物件名（ヘッダ除く）
+    next_row = len(col_a) + 1  # A列が常に埋まる前提の次の空行
     today = datetime.now().strftime('%Y/%m/%d')
-    new_count = 0
+    new_rows = []
+    pending = []  # (物件dict, 公式URLのFuture)
 
-    for p in properties:
-        name = p['name']
+    # properties はジェネレータでも良い（フェッチと並行してここが進む）。
+    # CSE照会は逐次ではなく小さなプールに投げて重ねる（レートは
+    # _CSE_BUCKET が抑えるので並列度はクォータに響かない）。
+    with ThreadPoolExecutor(max_workers=5) as cse_ex:
+        for p in properties:
+            name = p['name']
 
-        if os.getenv("DEBUG_ROW", "").lower() in ("1", "true", "on"):
-            print("[DBG ROW]", name, p.get('layout',''), p.get('area',''))
+            if os.getenv("DEBUG_ROW", "").lower() in ("1", "true", "on"):
+                print("[DBG ROW]", name, p.get('layout',''), p.get('area',''))
 
-        if name in existing:
-            print(f"⏭️ スキップ（重複）: {name}")
-            continue
+            if name in existing:
+                print(f"⏭️ スキップ（重複）: {name}")
+                continue
+
+            pending.append((p, cse_ex.submit(get_official_url, name)))
 
-        google_url = f"https://www.google.com/search?q={requests.utils.quote(name)}"
-        official_url = get_official_url(name)
+    for p, fut in pending:
+        name = p['name']
+        google_url = f"https://www.google.com/search?q={quote(name)}"
+        official_url = fut.result()
 
+        # fetch_property_details 側で整形済みのフィールドはそのまま使う。
+        # 外部由来の name / official_url だけここで再整形する。
         row = [
-            today,                                   # A: 取得日付
-            _sanitize_cell(name),                    # B: 物件名
-            "",                                      # C: （空欄）
-            _sanitize_cell(google_url),              # D: Google検索URL
-            _sanitize_cell(official_url),            # E: 公式URL
-            _sanitize_cell(p.get('image_url','')),   # F: 画像URL
-            _sanitize_cell(p.get('address','')),     # G: 住所
-            _sanitize_cell(p.get('layout','')),      # H: 間取り（例: 2LDK・3LDK）
-            _sanitize_cell(p.get('area','')),        # I: 専有面積（例: 44.83㎡～74.57㎡）
-            _sanitize_cell(p.get('access','')),      # J: 交通
-            _sanitize_cell(p.get('total_units','')), # K: 総戸数（数字のみ）
+            today,                         # A: 取得日付
+            _sanitize_cell(name),          # B: 物件名
+            "",                            # C: （空欄）
+            google_url,                    # D: Google検索URL（quote済み）
+            _sanitize_cell(official_url),  # E: 公式URL
+            p.get('image_url', ''),        # F: 画像URL
+            p.get('address', ''),          # G: 住所
+            p.get('layout', ''),           # H: 間取り（例: 2LDK・3LDK）
+            p.get('area', ''),             # I: 専有面積（例: 44.83㎡～74.57㎡）
+            p.get('access', ''),           # J: 交通
+            p.get('total_units', ''),      # K: 総戸数（数字のみ）
         ]
         # 必ず11列（A～K）に揃える（念のため）
         if len(row) < 11:
             row += [""] * (11 - len(row))
 
-        # A列の次の空行を計算して、明示的に A{r}:K{r} に書き込む
-        r = _next_empty_row_in_col_a(sheet)
-        sheet.update(f"A{r}:K{r}", [row], value_input_option='RAW')
+        new_rows.append(row)
 
-        new_count += 1
-        time.sleep(0.5)  # レート制御（必要に応じて調整）
+    # A列の次の空行から新規分をまとめて1回のAPI呼び出しで書き込む。
+    # 新規0件（全件既存）は正常ケースなので、サマリは必ず出す
+    if new_rows:
+        last_row = next_row + len(new_rows) - 1
+        sheet.update(f"A{next_row}:K{last_row}", new_rows, value_input_option='RAW')
 
-    print(f"✅ 新規追加: {new_count} 件")
+    print(f"✅ 新規追加: {len(new_rows)} 件")
 
 
-# === 8. メイン処理 ===
+# === 4. メイン処理 ===
 def main():
     try:
         cred = create_credentials_file()
-        properties = fetch_property_infos()
-        if not properties:
-            print("❌ 物件が取得できませんでした。")
-            return
-        write_to_sheet(properties, cred)
+        existing = _load_existing_names(cred)
+        # ジェネレータをそのまま渡し、詳細フェッチとCSE照会を重ねて実行する
+        write_to_sheet(fetch_property_infos(existing), cred)
     except Exception:
         print("❌ 実行時エラー:")
         traceback.print_exc()
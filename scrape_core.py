@@ -0,0 +1,79 @@
+# scrape_core.py
+"""scrape.py / fetch_april_properties.py が共有する土台。
+
+スプレッドシート設定・共有HTTPセッション・レート制御・シート認証を
+1か所に集約する（同じ修正を2ファイルへ当てずに済むように）。
+"""
+import os
+import tempfile
+import threading
+import time
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+import gspread
+from google.oauth2.service_account import Credentials
+
+# === スプレッドシート設定 ===
+SPREADSHEET_ID = '1LpduIjFPimgUX6g1j5cfLnMT6OayfA5un3it2Z5rwuE'
+SHEET_NAME = '新着物件'
+
+# === 共有HTTPセッション（keep-alive + リトライ） ===
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": "Mozilla/5.0"})
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    # raise_on_status=False: リトライ上限まで失敗したらRetryErrorではなく
+    # 最後のレスポンスを返す（呼び出し側のstatus_codeチェックを生かす）。
+    # 429はアダプタで消費せず、呼び出し側（CSEのRetry-After対応など）に任せる
+    max_retries=Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=[500, 502, 503, 504],
+        raise_on_status=False,
+    ),
+)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+# === 認証ファイル生成 ===
+def create_credentials_file():
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".json") as tmp:
+        tmp.write(os.environ['GOOGLE_CREDENTIALS_JSON'].encode())
+        return tmp.name
+
+class TokenBucket:
+    """同一ホストへの平均リクエストレートを抑える簡易トークンバケット。
+
+    固定スリープと違い、リクエスト自体にかかった時間もレートに織り込まれる。
+    スレッドセーフ（並列フェッチから共有して使う）。
+    """
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)          # tokens/秒
+        self.capacity = float(capacity)  # バースト上限
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+@lru_cache(maxsize=1)
+def get_sheet(cred_path):
+    """認証→open_by_key→worksheet をプロセス内で1回だけ行い、ハンドルを使い回す。"""
+    scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+    creds = Credentials.from_service_account_file(cred_path, scopes=scope)
+    client = gspread.authorize(creds)
+    return client.open_by_key(SPREADSHEET_ID).worksheet(SHEET_NAME)